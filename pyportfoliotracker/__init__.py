@@ -1 +1 @@
-from .objects import Fund
\ No newline at end of file
+from .objects import Fund, PositionBook
\ No newline at end of file
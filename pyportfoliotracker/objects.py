@@ -1,29 +1,89 @@
 from yahoofinancials import YahooFinancials
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import numpy as np
+from bisect import bisect_right
 #Random comment
 
+PERIODS_PER_YEAR = {'daily': 250, 'weekly': 52, 'monthly': 12}
+PERIOD_ALIASES = {'weekly': 'W-FRI', 'monthly': 'M'}
+COST_METHODS = ('fifo', 'lifo', 'average')
+
+def resample_to_frequency(df, column, frequency):
+    """
+    Resamples a DataFrame of daily rows (indexed by 'YYYY-MM-DD' dates) to 'daily', 'weekly' or 'monthly'.
+    Each week/month keeps its last row, labelled with the period's end date so that views of different assets line up.
+    The final period is usually only partly filled, so it is labelled with its last date instead, keeping the view point-in-time.
+    open/high/low, where present, are aggregated over the period.
+    Adds a 'log_returns' column computed from the given column. As with daily data, the first period's return is NaN, so that a
+    series starting part way through a period is not paired with a full-period return of another series.
+    """
+    if frequency not in PERIODS_PER_YEAR:
+        raise ValueError("frequency must be 'daily', 'weekly' or 'monthly', not " + repr(frequency))
+
+    if frequency == 'daily':
+        resampled = df.copy()
+        values = resampled[column].astype(float)
+        resampled['log_returns'] = np.log(values/values.shift(1))
+        return resampled
+
+    periods = pd.to_datetime(df.index).to_period(PERIOD_ALIASES[frequency])
+    is_last_of_period = ~periods.duplicated(keep='last')
+
+    resampled = df[is_last_of_period].copy()
+    grouped = df.groupby(periods)
+    for ohlc_column, aggregation in (('open', 'first'), ('high', 'max'), ('low', 'min')):
+        if ohlc_column in df.columns:
+            resampled[ohlc_column] = grouped[ohlc_column].agg(aggregation).values
+    labels = list(periods[is_last_of_period].end_time.strftime('%Y-%m-%d'))
+    labels[-1] = min(labels[-1], df.index[-1])
+    resampled.index = pd.Index(labels, name=df.index.name)
+
+    values = resampled[column].astype(float)
+    resampled['log_returns'] = np.log(values/values.shift(1))
+    return resampled
+
+def expanding_cov(x, y):
+    """
+    Returns the sample covariance of x and y over every expanding window, from cumulative sums in a single pass.
+    Pairs where either value is NaN are skipped, as in DataFrame.cov(). Windows with fewer than 2 pairs are NaN.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(valid, x, 0)
+    y = np.where(valid, y, 0)
+
+    n = np.cumsum(valid)
+    sum_x = np.cumsum(x)
+    sum_y = np.cumsum(y)
+    sum_xy = np.cumsum(x*y)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (sum_xy - sum_x*sum_y/n)/(n-1)
+    return np.where(n > 1, cov, np.nan)
+
 class Equity:
-    def __init__(self, ticker, date_of_purchase, qty, risk_free_rate):
+    def __init__(self, ticker, date_of_purchase, qty, risk_free_rate, as_of=None):
         """
         An Equity object.
-        date_of_purchase = Date when Equity is purchased.
-        qty = Quantity of equity purchased.
+        date_of_purchase = Date when Equity is first purchased.
+        qty = Quantity of equity held as of the latest date. Kept in sync by .update_historical_paper_value().
+        as_of = Date at which the equity is evaluated. Prices after this date are ignored. Defaults to today.
         historical_prices = Collects the historical prices of the equity from Yahoo Finance.
+        frequency_views = Cache of the historical_paper_value resampled to each frequency, filled by .get_frequency_view().
         """
         self.ticker = ticker
         self.date_of_purchase = date_of_purchase
         self.qty = qty
         self.risk_free_rate = risk_free_rate
+        self.as_of = as_of if as_of is not None else datetime.now().isoformat()[:10]
 
-        self.historical_prices = self.get_historical_prices(date_of_purchase,datetime.now().isoformat()[:10],'daily')
+        self.historical_prices = self.get_historical_prices(date_of_purchase,self.as_of,'daily')
         self.historical_prices_with_qty = self.get_historical_prices_with_qty()
         self.historical_paper_value = self.get_historical_paper_value()
-
-        self.equity_returns = self.get_equity_returns()
-        self.equity_returns_log = self.get_equity_returns_log()
+        self.frequency_views = {}
 
         self.beta = None
         self.sharpe_ratio = self.get_sharpe_ratio()
@@ -32,10 +92,12 @@ class Equity:
     def get_historical_prices(self,start,end,frequency):
         """
         Collects historical prices of the equity from Yahoo Finance.
-        Collects all data from the date of purchase until today
+        Collects all data from start up to and including end.
+        Yahoo Finance treats the end date as exclusive, so the data is requested up to the day after end.
         """
+        fetch_end = (datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
         equity_financials = YahooFinancials(self.ticker)
-        equity_data = equity_financials.get_historical_price_data(start, end, frequency)[self.ticker]['prices']
+        equity_data = equity_financials.get_historical_price_data(start, fetch_end, frequency)[self.ticker]['prices']
 
         df = pd.DataFrame(columns=['date','high','low','open','close','adjclose'])
     
@@ -50,6 +112,7 @@ class Equity:
                 }, ignore_index = True
                 )
         df = df.set_index('date')
+        df = df.loc[:end]
         return df
     
     def get_historical_prices_with_qty(self):
@@ -72,33 +135,30 @@ class Equity:
             df['paper_value'] = df['adjclose'] * df['qty']
             return df
 
-    def update_historical_paper_value(self):
+    def update_historical_paper_value(self, qty_history):
         """
         Updates historical paper value of an equity. This is done when an existing equity is bought or sold.
+        qty_history = A Series of the quantity held on each date, taken from the fund's PositionBook.
         """
+        self.historical_paper_value['qty'] = qty_history
         self.historical_paper_value = self.get_historical_paper_value(new=False)
+        self.qty = self.historical_paper_value['qty'].iloc[-1]
+        self.frequency_views = {}
 
-    def get_equity_returns(self):
-        """
-        Using the closing prices from the historical_prices attribute, get a DataFrame showing the log returns
-        """
-
-        df = self.historical_prices['adjclose'].copy()
-        returns = (df/df.shift(1))
-
-        return returns
-
-    def get_equity_returns_log(self):
+    def get_frequency_view(self, frequency='daily'):
         """
-        Return a DataFrame of the log returns
+        Returns the historical_paper_value resampled to 'daily', 'weekly' or 'monthly', with a 'log_returns' column.
+        Views are resampled from the daily data that is already loaded, and cached per frequency.
         """
-        df = self.equity_returns.copy()
-        log_returns = np.log(df)
+        if frequency not in self.frequency_views:
+            self.frequency_views[frequency] = resample_to_frequency(self.historical_paper_value, 'adjclose', frequency)
+        return self.frequency_views[frequency]
 
-        return log_returns
+    def get_log_returns(self, frequency='daily'):
+        return self.get_frequency_view(frequency)['log_returns']
 
-    def get_sharpe_ratio(self):
-        std_dev = self.get_std_dev_log_returns()
+    def get_sharpe_ratio(self, frequency='daily'):
+        std_dev = self.get_std_dev_log_returns(frequency)
         annualised_returns = self.get_average_returns_year()
 
         sharpe_ratio =(annualised_returns-self.risk_free_rate)/std_dev
@@ -108,7 +168,7 @@ class Equity:
         d0 = self.date_of_purchase
         d0_date = date(int(d0[:4]),int(d0[5:7]),int(d0[8:]))
 
-        d1 = datetime.now().isoformat()[:10]
+        d1 = self.as_of
         d1_date = date(int(d1[:4]),int(d1[5:7]),int(d1[8:]))
 
         time_difference = d1_date - d0_date
@@ -128,46 +188,52 @@ class Equity:
         annualised_returns = total_returns/years
         return annualised_returns
 
-    def get_std_dev_log_returns(self):
-        log_returns = self.equity_returns_log.copy()
-        std_dev = log_returns.std()*((250*self.get_years_since_dateofpurchase())**0.5) 
+    def get_std_dev_log_returns(self, frequency='daily'):
+        """
+        Returns the annualised standard deviation of the log returns sampled at the given frequency.
+        """
+        log_returns = self.get_log_returns(frequency)
+        std_dev = log_returns.std()*(PERIODS_PER_YEAR[frequency]**0.5)
         return std_dev
 
 class Index:
-    def __init__(self, ticker, cash_value, date_of_purchase, strategy='lump_sum', risk_free_rate=0.025):
+    def __init__(self, ticker, cash_value, date_of_purchase, strategy='lump_sum', risk_free_rate=0.025, as_of=None):
         """
         An Index object.
         cash_value = Cash value that is invested into the fund
         date_of_purchase = Date when cash is injected into the fund
+        as_of = Date at which the index is evaluated. Prices after this date are ignored. Defaults to today.
         strategy = Strategy of investing into the index fund. Currently only supports lump_sum strategy, looking to implement DCA soon.
         historical_prices = Collects the historical prices of the index from Yahoo Finance.
         qty = Quantity of index that is owned
         historical_paper_value = An update to the historical_prices DataFrame where the paper value of the index is reflected.
         complete_table = An update to the historical_paper_value DataFrame where the values are normalised to the initial value which is set at 100.
+        frequency_views = Cache of the complete_table resampled to each frequency, filled by .get_frequency_view().
         """
         self.ticker = ticker
         self.cash_value = cash_value
         self.date_of_purchase = date_of_purchase
         self.strategy = strategy
         self.risk_free_rate = risk_free_rate
+        self.as_of = as_of if as_of is not None else datetime.now().isoformat()[:10]
         
-        self.historical_prices = self.get_historical_prices(date_of_purchase,datetime.now().isoformat()[:10],'daily')
+        self.historical_prices = self.get_historical_prices(date_of_purchase,self.as_of,'daily')
         self.qty = self.qty_selector()
         self.historical_paper_value = self.historical_paper_value_selector()
         self.complete_table = self.create_complete_table()
-
-        self.index_returns = self.get_index_returns()
-        self.index_returns_log = self.get_index_returns_log()
+        self.frequency_views = {}
 
         self.sharpe_ratio = self.get_sharpe_ratio()
 
     def get_historical_prices(self,start,end,frequency):
         """
         Collects historical prices of the index from Yahoo Finance.
-        Collects all data from the date of purchase until today
+        Collects all data from start up to and including end.
+        Yahoo Finance treats the end date as exclusive, so the data is requested up to the day after end.
         """
+        fetch_end = (datetime.strptime(end, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
         equity_financials = YahooFinancials(self.ticker)
-        equity_data = equity_financials.get_historical_price_data(start, end, frequency)[self.ticker]['prices']
+        equity_data = equity_financials.get_historical_price_data(start, fetch_end, frequency)[self.ticker]['prices']
 
         df = pd.DataFrame(columns=['date','high','low','open','close','adjclose'])
     
@@ -182,6 +248,7 @@ class Index:
                 }, ignore_index = True
                 )
         df = df.set_index('date')
+        df = df.loc[:end]
         return df
 
     def historical_paper_value_selector(self):
@@ -265,27 +332,20 @@ class Index:
         df['normalised_value'] = (df['paper_value']/df['paper_value'].iloc[0])*100
         return df
 
-    def get_index_returns(self):
+    def get_frequency_view(self, frequency='daily'):
         """
-        Using the closing prices from the historical_prices attribute, get a DataFrame showing the log returns
+        Returns the complete_table resampled to 'daily', 'weekly' or 'monthly', with a 'log_returns' column.
+        Views are resampled from the daily data that is already loaded, and cached per frequency.
         """
+        if frequency not in self.frequency_views:
+            self.frequency_views[frequency] = resample_to_frequency(self.complete_table, 'adjclose', frequency)
+        return self.frequency_views[frequency]
 
-        df = self.historical_prices['adjclose'].copy()
-        returns = (df/df.shift(1))
-
-        return returns
+    def get_log_returns(self, frequency='daily'):
+        return self.get_frequency_view(frequency)['log_returns']
 
-    def get_index_returns_log(self):
-        """
-        Return a DataFrame of the log returns
-        """
-        df = self.index_returns.copy()
-        log_returns = np.log(df)
-
-        return log_returns
-
-    def get_sharpe_ratio(self):
-        std_dev = self.get_std_dev_log_returns()
+    def get_sharpe_ratio(self, frequency='daily'):
+        std_dev = self.get_std_dev_log_returns(frequency)
         annualised_returns = self.get_average_returns_year()
 
         sharpe_ratio =(annualised_returns-self.risk_free_rate)/std_dev
@@ -295,7 +355,7 @@ class Index:
         d0 = self.date_of_purchase
         d0_date = date(int(d0[:4]),int(d0[5:7]),int(d0[8:]))
 
-        d1 = datetime.now().isoformat()[:10]
+        d1 = self.as_of
         d1_date = date(int(d1[:4]),int(d1[5:7]),int(d1[8:]))
 
         time_difference = d1_date - d0_date
@@ -315,20 +375,276 @@ class Index:
         annualised_returns = total_returns/years
         return annualised_returns
 
-    def get_std_dev_log_returns(self):
-        log_returns = self.index_returns_log.copy()
-        std_dev = log_returns.std()*((250*self.get_years_since_dateofpurchase())**0.5) 
+    def get_std_dev_log_returns(self, frequency='daily'):
+        """
+        Returns the annualised standard deviation of the log returns sampled at the given frequency.
+        """
+        log_returns = self.get_log_returns(frequency)
+        std_dev = log_returns.std()*(PERIODS_PER_YEAR[frequency]**0.5)
         return std_dev
 
+def check_cost_method(cost_method):
+    """
+    Raises a ValueError if cost_method is not one of COST_METHODS.
+    """
+    if cost_method not in COST_METHODS:
+        raise ValueError("cost_method must be one of " + ", ".join(COST_METHODS) + ", not " + repr(cost_method))
+
+class Position:
+    def __init__(self, ticker, cost_method='fifo'):
+        """
+        A Position object. Holds the individual tax lots bought for a single ticker.
+        cost_method = Method used to match a sale against the open lots. Either 'fifo', 'lifo' or 'average'.
+        num_lots = Number of lots bought so far.
+        first_open = Position of the first lot that still has a remaining quantity.
+        trades = Contains lists [a,b] for every buy and sell, where a = signed quantity traded, b = date of trade.
+
+        Lots are kept in date order, in numpy arrays that grow by doubling. Buying a lot dated on or after the
+        others is amortised O(1), and every sale or P&L calculation is a single vectorised pass over the lots.
+        A sale is only matched against lots dated on or before it.
+        """
+        check_cost_method(cost_method)
+
+        self.ticker = ticker
+        self.cost_method = cost_method
+        self.num_lots = 0
+        self.first_open = 0
+        self.trades = []
+
+        self._dates = []
+        self._prices = np.zeros(8)
+        self._qty = np.zeros(8)
+        self._remaining = np.zeros(8)
+        self._realized_pnl = np.zeros(8)
+
+    @property
+    def lot_dates(self):
+        return np.array(self._dates, dtype=object)
+
+    @property
+    def lot_prices(self):
+        return self._prices[:self.num_lots]
+
+    @property
+    def lot_qty(self):
+        return self._qty[:self.num_lots]
+
+    @property
+    def lot_remaining(self):
+        return self._remaining[:self.num_lots]
+
+    @property
+    def lot_realized_pnl(self):
+        return self._realized_pnl[:self.num_lots]
+
+    def get_qty(self):
+        """
+        Returns the total quantity still held across all lots.
+        """
+        return self._remaining[self.first_open:self.num_lots].sum()
+
+    def get_average_cost(self):
+        """
+        Returns the average purchase price of the quantity still held.
+        """
+        remaining = self._remaining[self.first_open:self.num_lots]
+        prices = self._prices[self.first_open:self.num_lots]
+        total_qty = remaining.sum()
+        if total_qty == 0:
+            return 0.0
+        return (remaining * prices).sum() / total_qty
+
+    def get_lot_cost_basis(self):
+        """
+        Returns the cost basis of every lot. Under the average cost method every lot carries the average cost.
+        """
+        if self.cost_method == 'average':
+            return np.full(self.num_lots, self.get_average_cost())
+        return self.lot_prices.copy()
+
+    def buy(self, date_of_purchase, qty, price):
+        """
+        Adds a new lot to the position.
+        """
+        if qty <= 0:
+            raise ValueError("qty must be positive, not " + repr(qty))
+
+        if self.num_lots == len(self._prices):
+            self._grow()
+
+        # Insert after any lots on the same date, shifting later lots along when the buy is backdated
+        i = bisect_right(self._dates, date_of_purchase)
+        self._dates.insert(i, date_of_purchase)
+        for name, value in (('_prices', price), ('_qty', qty), ('_remaining', qty), ('_realized_pnl', 0)):
+            array = getattr(self, name)
+            array[i+1:self.num_lots+1] = array[i:self.num_lots]
+            array[i] = value
+        self.num_lots += 1
+        self.first_open = min(self.first_open, i)
+
+        self.trades.append([qty, date_of_purchase])
+
+    def sell(self, date_of_sale, qty, price):
+        """
+        Matches a sale against the open lots dated on or before date_of_sale, using the position's cost method.
+        Raises a ValueError if the sale is more than what is left of those lots, which is never more than the
+        quantity held on date_of_sale or on any later date, so a backdated sale cannot oversell.
+        Returns the realized P&L of the sale, which is also attributed to the lots it was matched against.
+        """
+        if qty <= 0:
+            raise ValueError("qty must be positive, not " + repr(qty))
+
+        open_lots = slice(self.first_open, max(self.first_open, bisect_right(self._dates, date_of_sale)))
+        remaining = self._remaining[open_lots]
+        total_qty = remaining.sum()
+        tolerance = total_qty * 1e-9
+        if qty > total_qty + tolerance:
+            raise ValueError("Cannot sell " + str(qty) + " of " + self.ticker + " on " + date_of_sale + ", only " + str(total_qty) + " held")
+
+        if self.cost_method == 'average':
+            cost_basis = (remaining * self._prices[open_lots]).sum() / total_qty
+            taken = np.minimum(remaining * (qty / total_qty), remaining)
+        else:
+            # Walk the open lots oldest first (FIFO) or newest first (LIFO) and take from each
+            # lot whatever is left of the sale after the lots before it.
+            cost_basis = self._prices[open_lots]
+            ordered = remaining if self.cost_method == 'fifo' else remaining[::-1]
+            qty_before = np.cumsum(ordered) - ordered
+            taken = np.clip(qty - qty_before, 0, ordered)
+            if self.cost_method == 'lifo':
+                taken = taken[::-1]
+
+        realized = taken * (price - cost_basis)
+        remaining -= taken
+        # Close out floating point leftovers so that closed lots are not treated as open
+        remaining[remaining <= tolerance] = 0
+        self._realized_pnl[open_lots] += realized
+
+        open_positions = np.flatnonzero(remaining > 0)
+        if len(open_positions) == 0:
+            self.first_open = open_lots.stop
+        else:
+            self.first_open += open_positions[0]
+
+        self.trades.append([-qty, date_of_sale])
+
+        return realized.sum()
+
+    def get_unrealized_pnl(self, market_price):
+        """
+        Returns the unrealized P&L of every lot when valued at market_price.
+        """
+        return self.lot_remaining * (market_price - self.get_lot_cost_basis())
+
+    def get_trades(self):
+        """
+        Returns a Series of the net quantity traded on each date, sorted by date.
+        """
+        return pd.Series(
+            [trade[0] for trade in self.trades],
+            index=[trade[1] for trade in self.trades],
+            dtype=float,
+        ).groupby(level=0).sum()
+
+    def get_qty_history(self, dates):
+        """
+        Returns a Series of the quantity held at the end of each of the given dates, derived from the trades.
+        """
+        trades = self.get_trades()
+
+        all_dates = pd.Index(dates).union(trades.index)
+        qty = trades.reindex(all_dates, fill_value=0).cumsum()
+        return qty.reindex(dates)
+
+    def _grow(self):
+        capacity = 2 * len(self._prices)
+        for name in ('_prices', '_qty', '_remaining', '_realized_pnl'):
+            array = np.zeros(capacity)
+            array[:self.num_lots] = getattr(self, name)[:self.num_lots]
+            setattr(self, name, array)
+
+class PositionBook:
+    def __init__(self, cost_method='fifo'):
+        """
+        A PositionBook object. Holds a Position for each ticker owned by the fund.
+        cost_method = Method used to match sales against lots. Either 'fifo', 'lifo' or 'average'.
+        positions = A dict of ticker -> Position, giving O(1) lookup of a holding.
+        """
+        check_cost_method(cost_method)
+
+        self.cost_method = cost_method
+        self.positions = {}
+
+    def __contains__(self, ticker):
+        return ticker in self.positions
+
+    def __getitem__(self, ticker):
+        return self.positions[ticker]
+
+    def buy(self, ticker, date_of_purchase, qty, price):
+        """
+        Records a new lot for the ticker, opening a Position if the ticker is not yet held. Returns the Position.
+        """
+        if ticker not in self.positions:
+            self.positions[ticker] = Position(ticker, self.cost_method)
+        position = self.positions[ticker]
+        position.buy(date_of_purchase, qty, price)
+        return position
+
+    def sell(self, ticker, date_of_sale, qty, price):
+        """
+        Matches a sale against the ticker's lots. Returns the realized P&L of the sale.
+        """
+        if ticker not in self.positions:
+            raise ValueError("Cannot sell " + ticker + ", it is not held by the fund")
+        return self.positions[ticker].sell(date_of_sale, qty, price)
+
+    def get_lots_table(self, market_prices=None):
+        """
+        Returns a DataFrame with one row per lot across all tickers.
+        market_prices = Optional dict/Series of ticker -> price. When given, adds the market_price and unrealized_pnl columns.
+        """
+        positions = list(self.positions.values())
+        df = pd.DataFrame({
+            'ticker': np.repeat([position.ticker for position in positions], [position.num_lots for position in positions]),
+            'date': np.concatenate([position.lot_dates for position in positions] or [np.array([], dtype=object)]),
+            'price': np.concatenate([position.lot_prices for position in positions] or [np.array([])]),
+            'qty': np.concatenate([position.lot_qty for position in positions] or [np.array([])]),
+            'remaining': np.concatenate([position.lot_remaining for position in positions] or [np.array([])]),
+            'cost_basis': np.concatenate([position.get_lot_cost_basis() for position in positions] or [np.array([])]),
+            'realized_pnl': np.concatenate([position.lot_realized_pnl for position in positions] or [np.array([])]),
+        })
+
+        if market_prices is not None:
+            df['market_price'] = pd.Series(market_prices, dtype=float).reindex(df['ticker']).values
+            df['unrealized_pnl'] = df['remaining'] * (df['market_price'] - df['cost_basis'])
+
+        return df
+
+    def get_realized_pnl(self):
+        """
+        Returns a Series of the realized P&L of each ticker.
+        """
+        return pd.Series({ticker: position.lot_realized_pnl.sum() for ticker, position in self.positions.items()}, dtype=float)
+
+    def get_unrealized_pnl(self, market_prices):
+        """
+        Returns a Series of the unrealized P&L of each ticker, valued at market_prices (dict/Series of ticker -> price).
+        """
+        df = self.get_lots_table(market_prices)
+        return df.groupby('ticker', sort=False)['unrealized_pnl'].sum()
+
 class Fund:
-    def __init__(self, cash, index_ticker, date_of_creation, strategy='lump_sum', risk_free_rate_percentage=2.5):
+    def __init__(self, cash, index_ticker, date_of_creation, strategy='lump_sum', risk_free_rate_percentage=2.5, cost_method='fifo', as_of=None):
         """
         A Fund object.
         cash = Total amount of cash injected into the fund.
         index_ticker = The ticker of the index used as the fund's benchmark.
         date_of_creation = Date when the fund is created.
-        equities = Equities owned by the fund. Add on equities using the .buy_equity method.
+        equities = A dict of ticker -> Equity owned by the fund. Add on equities using the .buy_equity method.
         strategy = The strategy used for the equivalent index comparison.
+        cost_method = Method used to match sales against the bought lots. Either 'fifo', 'lifo' or 'average'.
+        as_of = Date at which the fund, its index and its equities are evaluated. Prices after this date are ignored. Defaults to today.
 
         index = Contains an Index object that is created based on the index_ticker attribute.
         cash_df = A DataFrame that contains Index performance and the amount of cash owned by the fund.
@@ -338,14 +654,20 @@ class Fund:
 
         all_assets = A DataFrame that adds on the total asset value owned by the fund in addition to the cash_df.
         all_assets_normalised = A DataFrame that adds on the normalised total asset value.
+        positions = A PositionBook holding the individual lots bought of every equity.
+        frequency_views = Cache of all_assets_normalised resampled to each frequency, filled by .get_frequency_view().
         """
         self.cash = cash
         self.index_ticker = index_ticker
         self.date_of_creation = date_of_creation
-        self.equities = []
+        self.equities = {}
         self.strategy = strategy
+        self.positions = PositionBook(cost_method)
         self.risk_free_rate_percentage = risk_free_rate_percentage
         self.risk_free_rate = self.risk_free_rate_percentage/100
+        self.as_of = as_of if as_of is not None else datetime.now().isoformat()[:10]
+        if self.as_of < self.date_of_creation:
+            raise ValueError("as_of date " + self.as_of + " is before the fund's date_of_creation " + self.date_of_creation)
 
         self.index = self.initialise_index()
         self.cash_df = self.get_cash_df()
@@ -353,9 +675,7 @@ class Fund:
 
         self.all_assets = self.compile_all_assets()
         self.all_assets_normalised = self.normalise_all_assets()
-
-        self.fund_returns = self.get_fund_returns()
-        self.fund_returns_log = self.get_fund_returns_log()
+        self.frequency_views = {}
 
         self.beta = self.get_fund_beta()
         self.sharpe_ratio = self.get_sharpe_ratio()
@@ -365,7 +685,23 @@ class Fund:
         """
         Creates an Index object based on the ticker specified in index_ticker
         """
-        return Index(self.index_ticker, self.cash, self.date_of_creation, self.strategy, self.risk_free_rate)
+        return Index(self.index_ticker, self.cash, self.date_of_creation, self.strategy, self.risk_free_rate, self.as_of)
+
+    def initialise_equity(self, ticker, date_of_purchase, qty):
+        """
+        Creates an Equity object for the ticker and calculates its beta and alpha against the fund's index
+        """
+        equity = Equity(ticker, date_of_purchase, qty, self.risk_free_rate, self.as_of)
+
+        beta = self.get_equity_beta(equity)
+
+        equity.beta = beta
+
+        alpha = self.get_alpha(beta, equity.get_average_returns_year())
+
+        equity.alpha = alpha
+
+        return equity
 
     def compile_all_assets(self):
         """
@@ -380,7 +716,7 @@ class Fund:
 
         df = self.check_cash_deductions(df)
 
-        for equity in self.equities:
+        for equity in self.equities.values():
             df[equity.ticker] = equity.historical_paper_value['paper_value']
             df[equity.ticker+' qty']= equity.historical_paper_value['qty']
             df[equity.ticker].fillna(0, inplace=True)
@@ -406,24 +742,34 @@ class Fund:
             df.loc[deduction[1]:,'cash'] -= deduction[0]
         return df
 
+    def check_trade_date(self, date_of_trade):
+        """
+        Raises a ValueError if a trade is dated after the fund's as_of date, as there are no prices to value it with.
+        """
+        if date_of_trade > self.as_of:
+            raise ValueError("Trade dated " + date_of_trade + " is after the fund's as_of date " + self.as_of)
+
     def sell_equity(self, ticker, date_of_sale, qty, price):
         """
         This method is called when an equity is sold for cash.
+        The sale is matched against the equity's lots in positions, raising a ValueError if the equity is not held or qty exceeds the quantity held on date_of_sale.
         Updates the attributes equities and cash_deductions accordingly.
         Then updates the all_assets and all_assets_normalised.
         """
-        for equity in self.equities:
-            if equity.ticker == ticker:
-                equity.historical_paper_value.loc[date_of_sale:,'qty'] -= qty
-                equity.update_historical_paper_value()
+        self.check_trade_date(date_of_sale)
+        if ticker not in self.equities:
+            raise ValueError("Cannot sell " + ticker + ", it is not held by the fund")
+        self.positions.sell(ticker, date_of_sale, qty, price)
+
+        equity = self.equities[ticker]
+        equity.update_historical_paper_value(self.positions[ticker].get_qty_history(equity.historical_prices.index))
 
         self.cash_deductions.append([-(price*qty), date_of_sale])
 
         self.all_assets = self.compile_all_assets()
         self.all_assets_normalised = self.normalise_all_assets()
+        self.frequency_views = {}
 
-        self.fund_returns = self.get_fund_returns()
-        self.fund_returns_log = self.get_fund_returns_log()
         self.beta = self.get_fund_beta()
         self.sharpe_ratio = self.get_sharpe_ratio()
         self.alpha = self.get_fund_alpha()    
@@ -433,54 +779,29 @@ class Fund:
         This method is called when cash is used to buy an equity.
         Updates the attributes equities and cash_deductions accordingly.
         An Equity is created based on the input values, and the beta value is calculated.
+        If the equity is already held but this purchase is dated before its first one, the Equity is created again
+        so that its prices start from the earlier date.
         Then updates the all_assets and all_assets_normalised.
         """
-        if len(self.equities) == 0:
-            equity_to_add = Equity(ticker, date_of_purchase, qty, self.risk_free_rate)
-
-            cov_with_market = self.get_cov_with_market(equity_to_add.equity_returns_log,self.index.index_returns_log)
-            market_var = self.get_market_var(self.index.index_returns_log)
-            beta = self.get_beta(cov_with_market,market_var)
-
-            equity_to_add.beta = beta
-
-            alpha = self.get_alpha(beta, equity_to_add.get_average_returns_year())
-
-            equity_to_add.alpha = alpha
+        self.check_trade_date(date_of_purchase)
 
-            self.equities.append(equity_to_add)
+        if ticker not in self.equities or date_of_purchase < self.equities[ticker].date_of_purchase:
+            # Build the Equity before recording the lot, so a failed fetch leaves positions untouched
+            equity = self.initialise_equity(ticker, date_of_purchase, qty)
+            position = self.positions.buy(ticker, date_of_purchase, qty, price)
+            self.equities[ticker] = equity
+        else:
+            equity = self.equities[ticker]
+            position = self.positions.buy(ticker, date_of_purchase, qty, price)
 
-
-        elif len(self.equities) != 0:
-            counter = 0
-            for equity in self.equities:
-                if equity.ticker == ticker:
-                    equity.historical_paper_value.loc[date_of_purchase:,'qty'] += qty
-                    equity.update_historical_paper_value()
-                else:
-                    counter += 1
-            if counter == len(self.equities):
-                equity_to_add = Equity(ticker, date_of_purchase, qty, self.risk_free_rate)
-
-                cov_with_market = self.get_cov_with_market(equity_to_add.equity_returns_log,self.index.index_returns_log)
-                market_var = self.get_market_var(self.index.index_returns_log)
-                beta = self.get_beta(cov_with_market,market_var)
-
-                equity_to_add.beta = beta
-
-                alpha = self.get_alpha(beta, equity_to_add.get_average_returns_year())
-
-                equity_to_add.alpha = alpha
-
-                self.equities.append(equity_to_add)
+        equity.update_historical_paper_value(position.get_qty_history(equity.historical_prices.index))
 
         self.cash_deductions.append([price*qty, date_of_purchase])
 
         self.all_assets = self.compile_all_assets()
         self.all_assets_normalised = self.normalise_all_assets()
+        self.frequency_views = {}
 
-        self.fund_returns = self.get_fund_returns()
-        self.fund_returns_log = self.get_fund_returns_log()
         self.beta = self.get_fund_beta()
         self.sharpe_ratio = self.get_sharpe_ratio()
         self.alpha = self.get_fund_alpha()
@@ -492,7 +813,7 @@ class Fund:
         df = self.all_assets.copy()
         
         tickers_equity = ['cash']
-        for equity in self.equities:
+        for equity in self.equities.values():
             tickers_equity.append(equity.ticker)
 
         cash_and_equities_df = df.loc[:,tickers_equity].copy()
@@ -508,15 +829,15 @@ class Fund:
 
         return df
 
-    def get_cov_with_market(self, equity_log_returns, index_log_returns):
+    def get_cov_with_market(self, equity_log_returns, index_log_returns, frequency='daily'):
         df = pd.concat([equity_log_returns, index_log_returns], axis=1)
-        cov=df.cov()*250
+        cov=df.cov()*PERIODS_PER_YEAR[frequency]
         cov_with_market=cov.iloc[0,1]
 
         return cov_with_market
     
-    def get_market_var(self, index_log_returns):
-        market_var = index_log_returns.var()*250
+    def get_market_var(self, index_log_returns, frequency='daily'):
+        market_var = index_log_returns.var()*PERIODS_PER_YEAR[frequency]
         return market_var
 
     def get_beta(self, cov_with_market, market_var):
@@ -528,37 +849,37 @@ class Fund:
         alpha = average_returns - expected_rate_of_return
         return alpha
 
-    def get_fund_alpha(self):
-        alpha = self.get_alpha(self.beta, self.get_average_returns_year())
-        return alpha
-
-    def get_fund_returns(self):
-        """
-        Using the closing prices from the historical_prices attribute, get a DataFrame showing the log returns
-        """
-
-        df = self.all_assets_normalised['normalised_asset_value'].copy()
-        returns = (df/df.shift(1))
+    def get_equity_beta(self, equity, frequency='daily'):
+        cov_with_market = self.get_cov_with_market(equity.get_log_returns(frequency),self.index.get_log_returns(frequency),frequency)
+        market_var = self.get_market_var(self.index.get_log_returns(frequency),frequency)
+        beta = self.get_beta(cov_with_market,market_var)
+        return beta
 
-        return returns
+    def get_fund_alpha(self, frequency='daily'):
+        beta = self.beta if frequency == 'daily' else self.get_fund_beta(frequency)
+        alpha = self.get_alpha(beta, self.get_average_returns_year())
+        return alpha
 
-    def get_fund_returns_log(self):
+    def get_frequency_view(self, frequency='daily'):
         """
-        Return a DataFrame of the log returns
+        Returns all_assets_normalised resampled to 'daily', 'weekly' or 'monthly', with a 'log_returns' column of the fund.
+        Views are resampled from the daily data that is already loaded, and cached per frequency until the next buy/sell.
         """
-        df = self.fund_returns.copy()
-        log_returns = np.log(df)
+        if frequency not in self.frequency_views:
+            self.frequency_views[frequency] = resample_to_frequency(self.all_assets_normalised, 'normalised_asset_value', frequency)
+        return self.frequency_views[frequency]
 
-        return log_returns
+    def get_log_returns(self, frequency='daily'):
+        return self.get_frequency_view(frequency)['log_returns']
 
-    def get_fund_beta(self):
-        cov_with_market = self.get_cov_with_market(self.fund_returns_log,self.index.index_returns_log)
-        market_var = self.get_market_var(self.index.index_returns_log)
+    def get_fund_beta(self, frequency='daily'):
+        cov_with_market = self.get_cov_with_market(self.get_log_returns(frequency),self.index.get_log_returns(frequency),frequency)
+        market_var = self.get_market_var(self.index.get_log_returns(frequency),frequency)
         beta = self.get_beta(cov_with_market,market_var)
         return beta
 
-    def get_sharpe_ratio(self):
-        std_dev = self.get_std_dev_log_returns()
+    def get_sharpe_ratio(self, frequency='daily'):
+        std_dev = self.get_std_dev_log_returns(frequency)
         annualised_returns = self.get_average_returns_year()
         if std_dev == 0:
             std_dev = 1000000000
@@ -570,7 +891,7 @@ class Fund:
         d0 = self.date_of_creation
         d0_date = date(int(d0[:4]),int(d0[5:7]),int(d0[8:]))
 
-        d1 = datetime.now().isoformat()[:10]
+        d1 = self.as_of
         d1_date = date(int(d1[:4]),int(d1[5:7]),int(d1[8:]))
 
         time_difference = d1_date - d0_date
@@ -590,11 +911,60 @@ class Fund:
         annualised_returns = total_returns/years
         return annualised_returns
 
-    def get_std_dev_log_returns(self):
-        log_returns = self.fund_returns_log.copy()
-        std_dev = log_returns.std()*((250*self.get_years_since_dateofpurchase())**0.5) 
+    def get_std_dev_log_returns(self, frequency='daily'):
+        """
+        Returns the annualised standard deviation of the log returns sampled at the given frequency.
+        """
+        log_returns = self.get_log_returns(frequency)
+        std_dev = log_returns.std()*(PERIODS_PER_YEAR[frequency]**0.5)
         return std_dev
 
+    def get_expanding_metrics(self, frequency='daily'):
+        """
+        Returns a DataFrame of the fund's annualised_return, volatility, beta, alpha and sharpe_ratio as of every date,
+        each calculated over the window from the date of creation up to that date.
+        The last row is evaluated at the fund's as_of date, so it matches .fund_metrics_table(frequency).
+        The whole history is calculated in one vectorised pass over cumulative sums, instead of rebuilding the fund per date.
+        frequency = Sampling frequency of the returns. Either 'daily', 'weekly' or 'monthly'.
+        """
+        fund_view = self.get_frequency_view(frequency)
+        index_view = self.index.get_frequency_view(frequency).reindex(fund_view.index)
+        periods_per_year = PERIODS_PER_YEAR[frequency]
+
+        evaluation_dates = pd.to_datetime(fund_view.index).values.copy()
+        evaluation_dates[-1] = np.datetime64(self.as_of)
+        evaluation_dates = np.minimum(evaluation_dates, np.datetime64(self.as_of))
+        years = pd.TimedeltaIndex(evaluation_dates - np.datetime64(self.date_of_creation)).days.values/365
+        years = np.where(years > 0, years, np.nan)
+
+        fund_values = fund_view['normalised_asset_value'].astype(float).values
+        fund_initial_value = self.all_assets_normalised['normalised_asset_value'].iloc[0]
+        index_prices = index_view['adjclose'].astype(float).values
+        index_initial_price = self.index.historical_prices['adjclose'].iloc[0]
+
+        fund_log_returns = fund_view['log_returns'].values
+        index_log_returns = index_view['log_returns'].values
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            annualised_returns = ((fund_values - fund_initial_value)/fund_initial_value)/years
+            index_annualised_returns = ((index_prices - index_initial_price)/index_initial_price)/years
+
+            volatility = (np.maximum(expanding_cov(fund_log_returns, fund_log_returns), 0)*periods_per_year)**0.5
+            cov_with_market = expanding_cov(fund_log_returns, index_log_returns)*periods_per_year
+            market_var = expanding_cov(index_log_returns, index_log_returns)*periods_per_year
+
+            beta = cov_with_market/market_var
+            alpha = annualised_returns - (self.risk_free_rate + (beta*(index_annualised_returns-self.risk_free_rate)))
+            sharpe_ratio = (annualised_returns-self.risk_free_rate)/np.where(volatility == 0, 1000000000, volatility)
+
+        return pd.DataFrame({
+            'annualised_return': annualised_returns,
+            'volatility': volatility,
+            'beta': beta,
+            'alpha': alpha,
+            'sharpe_ratio': sharpe_ratio,
+            }, index=fund_view.index)
+
     def plot_fund_performance(self):
         """
         Plots the fund's performance against the index.
@@ -608,26 +978,46 @@ class Fund:
         df.plot(figsize=(12,4))
         plt.show()
 
-    def fund_metrics_table(self):
+    def fund_metrics_table(self, frequency='daily'):
+        """
+        Returns a DataFrame of alpha, beta and Sharpe ratio of the fund, the index and each equity.
+        frequency = Sampling frequency of the returns used for the metrics. Either 'daily', 'weekly' or 'monthly'.
+        """
+        if frequency == 'daily':
+            fund_beta = self.beta
+            fund_sharpe_ratio = self.sharpe_ratio
+            index_sharpe_ratio = self.index.sharpe_ratio
+        else:
+            fund_beta = self.get_fund_beta(frequency)
+            fund_sharpe_ratio = self.get_sharpe_ratio(frequency)
+            index_sharpe_ratio = self.index.get_sharpe_ratio(frequency)
+
         df = pd.DataFrame(columns=['alpha','beta','sharpe_ratio','percentage_share'])
         df = df.append(pd.Series(data={
-            'alpha': self.alpha,
-            'beta': self.beta,
-            'sharpe_ratio': self.sharpe_ratio,
+            'alpha': self.get_alpha(fund_beta, self.get_average_returns_year()),
+            'beta': fund_beta,
+            'sharpe_ratio': fund_sharpe_ratio,
             'percentage_share': '100%',
             }, name='Fund'))
         df = df.append(pd.Series(data={
             'alpha': 'N/A',
             'beta': 1,
-            'sharpe_ratio': self.index.sharpe_ratio,
+            'sharpe_ratio': index_sharpe_ratio,
             'percentage_share': 'N/A',
             }, name=self.index.ticker))
 
-        for equity in self.equities:
+        for equity in self.equities.values():
+            if frequency == 'daily':
+                equity_beta = equity.beta
+                equity_sharpe_ratio = equity.sharpe_ratio
+            else:
+                equity_beta = self.get_equity_beta(equity, frequency)
+                equity_sharpe_ratio = equity.get_sharpe_ratio(frequency)
+
             df = df.append(pd.Series(data={
-            'alpha': equity.alpha,
-            'beta': equity.beta,
-            'sharpe_ratio': equity.sharpe_ratio,
+            'alpha': self.get_alpha(equity_beta, equity.get_average_returns_year()),
+            'beta': equity_beta,
+            'sharpe_ratio': equity_sharpe_ratio,
             'percentage_share': format(((self.all_assets_normalised[equity.ticker].iloc[-1])/(self.all_assets_normalised['total_asset_value'].iloc[-1]))*100, ".2f") + "%"
             }, name=equity.ticker))
 
@@ -642,6 +1032,13 @@ class Fund:
 
         return df
     
+    def lots_table(self):
+        """
+        Returns a DataFrame of every lot bought by the fund, with its realized P&L and its unrealized P&L valued at the latest adjusted close.
+        """
+        market_prices = {ticker: equity.historical_prices['adjclose'].iloc[-1] for ticker, equity in self.equities.items()}
+        return self.positions.get_lots_table(market_prices)
+
     def export_graph(self, export_name='data/fund-graph-plot.png'):
         df = pd.DataFrame()
         df2 = self.all_assets_normalised
@@ -663,8 +1060,9 @@ class Fund:
             export_name, index=True, columns=list(df.columns)
         )
     
-    def export_fund_metrics(self, export_name='data/fund-metrics.csv'):
-        self.fund_metrics_table().to_csv(
-            export_name, index=True, columns=list(self.fund_metrics_table().columns)
+    def export_fund_metrics(self, export_name='data/fund-metrics.csv', frequency='daily'):
+        df = self.fund_metrics_table(frequency)
+        df.to_csv(
+            export_name, index=True, columns=list(df.columns)
         )
 
@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyportfoliotracker import objects
+
+
+class FakeYahooFinancials:
+    """
+    Serves seeded random daily prices. Like Yahoo Finance, the end date is exclusive.
+    """
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def get_historical_price_data(self, start, end, frequency):
+        seed = {'IDX': 1, 'AAA': 2, 'BBB': 3}[self.ticker]
+        dates = pd.bdate_range('2020-01-01', '2020-12-31')
+        prices = 100 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.01, len(dates))))
+        return {self.ticker: {'prices': [
+            {'formatted_date': d, 'high': p, 'low': p, 'open': p, 'close': p, 'adjclose': p}
+            for d, p in zip(dates.strftime('%Y-%m-%d'), prices) if start <= d < end
+            ]}}
+
+
+@pytest.fixture
+def fake_yahoo(monkeypatch):
+    """
+    Replaces Yahoo Finance with FakeYahooFinancials, which serves seeded random prices for 'IDX', 'AAA' and 'BBB'.
+    """
+    monkeypatch.setattr(objects, 'YahooFinancials', FakeYahooFinancials)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyportfoliotracker import Fund
+from pyportfoliotracker.objects import resample_to_frequency
+
+
+def make_daily_prices(start, end):
+    dates = pd.bdate_range(start, end)
+    prices = 100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(dates))))
+    df = pd.DataFrame({
+        'date': dates.strftime('%Y-%m-%d'),
+        'high': prices * 1.01,
+        'low': prices * 0.99,
+        'open': prices,
+        'close': prices,
+        'adjclose': prices,
+        })
+    return df.set_index('date')
+
+
+@pytest.mark.parametrize('frequency, labels', [
+    ('weekly', ['2020-05-22', '2020-05-29', '2020-06-05', '2020-06-12', '2020-06-17']),
+    ('monthly', ['2020-05-31', '2020-06-17']),
+])
+def test_resample_labels_final_period_with_last_date(frequency, labels):
+    df = make_daily_prices('2020-05-18', '2020-06-17')
+
+    resampled = resample_to_frequency(df, 'adjclose', frequency)
+
+    assert list(resampled.index) == labels
+    assert resampled['adjclose'].iloc[-1] == df['adjclose'].iloc[-1]
+
+
+@pytest.mark.parametrize('frequency', ['daily', 'weekly', 'monthly'])
+def test_resample_first_log_return_is_nan(frequency):
+    df = make_daily_prices('2020-05-20', '2020-07-17')
+
+    resampled = resample_to_frequency(df, 'adjclose', frequency)
+
+    assert np.isnan(resampled['log_returns'].iloc[0])
+    assert resampled['log_returns'].iloc[1:].sum() == pytest.approx(np.log(df['adjclose'].iloc[-1] / resampled['adjclose'].iloc[0]))
+
+
+def test_resample_aggregates_ohlc():
+    df = make_daily_prices('2020-05-18', '2020-06-17')
+
+    resampled = resample_to_frequency(df, 'adjclose', 'monthly')
+
+    assert resampled['high'].iloc[0] == df.loc[:'2020-05-31', 'high'].max()
+    assert resampled['low'].iloc[0] == df.loc[:'2020-05-31', 'low'].min()
+    assert resampled['open'].iloc[0] == df['open'].iloc[0]
+
+
+@pytest.mark.parametrize('as_of', ['2020-06-17', '2020-06-20', '2020-12-31'])
+@pytest.mark.parametrize('frequency', ['daily', 'weekly', 'monthly'])
+def test_expanding_metrics_last_row_matches_fund_metrics_table(fake_yahoo, frequency, as_of):
+    fund = Fund(100000, 'IDX', '2020-05-18', as_of=as_of)
+    fund.buy_equity('AAA', '2020-05-18', 100, 100)
+    fund.buy_equity('BBB', '2020-05-26', 200, 100)
+    fund.sell_equity('AAA', '2020-06-01', 40, 105)
+
+    last_row = fund.get_expanding_metrics(frequency).iloc[-1]
+    table = fund.fund_metrics_table(frequency).loc['Fund']
+
+    assert fund.get_expanding_metrics(frequency).index[-1] <= as_of
+    assert last_row['annualised_return'] == pytest.approx(fund.get_average_returns_year(), nan_ok=True)
+    assert last_row['volatility'] == pytest.approx(fund.get_std_dev_log_returns(frequency), nan_ok=True)
+    assert last_row['beta'] == pytest.approx(table['beta'], nan_ok=True)
+    assert last_row['alpha'] == pytest.approx(table['alpha'], nan_ok=True)
+    assert last_row['sharpe_ratio'] == pytest.approx(table['sharpe_ratio'], nan_ok=True)
+
+
+def test_as_of_close_is_included(fake_yahoo):
+    fund = Fund(100000, 'IDX', '2020-05-18', as_of='2020-06-17')
+    fund.buy_equity('AAA', '2020-05-18', 100, 100)
+
+    assert fund.index.historical_prices.index[-1] == '2020-06-17'
+    assert fund.equities['AAA'].historical_prices.index[-1] == '2020-06-17'
+    assert fund.all_assets_normalised.index[-1] == '2020-06-17'
+
+
+def test_as_of_before_date_of_creation_raises(fake_yahoo):
+    with pytest.raises(ValueError):
+        Fund(100000, 'IDX', '2020-05-18', as_of='2020-05-01')
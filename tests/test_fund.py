@@ -0,0 +1,26 @@
+import pytest
+
+from pyportfoliotracker import Fund
+
+
+def test_sale_dated_before_purchase_raises_and_leaves_cash(fake_yahoo):
+    fund = Fund(100000, 'IDX', '2020-05-18', as_of='2020-12-31')
+    fund.buy_equity('AAA', '2020-06-10', 10, 100)
+
+    with pytest.raises(ValueError):
+        fund.sell_equity('AAA', '2020-06-01', 5, 100)
+    assert fund.all_assets.loc['2020-06-01', 'cash'] == 100000
+    assert fund.cash_deductions == [[1000, '2020-06-10']]
+
+
+def test_buy_dated_before_first_purchase_extends_prices(fake_yahoo):
+    fund = Fund(100000, 'IDX', '2020-05-18', as_of='2020-12-31')
+    fund.buy_equity('AAA', '2020-06-01', 10, 100)
+    fund.buy_equity('AAA', '2020-05-20', 5, 100)
+
+    equity = fund.equities['AAA']
+    assert equity.date_of_purchase == '2020-05-20'
+    assert equity.historical_prices.index[0] == '2020-05-20'
+    assert equity.qty == 15
+    assert list(fund.all_assets.loc['2020-05-20':'2020-05-29', 'AAA qty'].unique()) == [5]
+    assert fund.all_assets.loc['2020-06-01', 'AAA qty'] == 15
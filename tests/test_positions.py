@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyportfoliotracker import PositionBook
+from pyportfoliotracker.objects import Position
+
+
+def make_book(cost_method):
+    book = PositionBook(cost_method)
+    book.buy('AAA', '2020-01-01', 10, 100)
+    book.buy('AAA', '2020-01-03', 10, 120)
+    book.buy('BBB', '2020-01-02', 5, 50)
+    return book
+
+
+@pytest.mark.parametrize('cost_method, realized, remaining, lot_realized', [
+    ('fifo', 400, [0, 10], [400, 0]),
+    ('lifo', 200, [10, 0], [0, 200]),
+    ('average', 300, [5, 5], [150, 150]),
+])
+def test_sell_matches_lots(cost_method, realized, remaining, lot_realized):
+    book = make_book(cost_method)
+
+    assert book.sell('AAA', '2020-01-04', 10, 140) == pytest.approx(realized)
+    np.testing.assert_allclose(book['AAA'].lot_remaining, remaining)
+    np.testing.assert_allclose(book['AAA'].lot_realized_pnl, lot_realized)
+    assert book.get_realized_pnl().to_dict() == pytest.approx({'AAA': realized, 'BBB': 0})
+
+
+@pytest.mark.parametrize('cost_method, unrealized', [
+    ('fifo', 300),
+    ('lifo', 500),
+    ('average', 400),
+])
+def test_unrealized_pnl(cost_method, unrealized):
+    book = make_book(cost_method)
+    book.sell('AAA', '2020-01-04', 10, 140)
+
+    assert book.get_unrealized_pnl({'AAA': 150, 'BBB': 60}).to_dict() == pytest.approx({'AAA': unrealized, 'BBB': 50})
+
+
+def test_lots_table():
+    book = make_book('fifo')
+    book.sell('AAA', '2020-01-04', 15, 130)
+
+    df = book.get_lots_table({'AAA': 140, 'BBB': 60})
+
+    assert list(df['ticker']) == ['AAA', 'AAA', 'BBB']
+    assert list(df['date']) == ['2020-01-01', '2020-01-03', '2020-01-02']
+    np.testing.assert_allclose(df['remaining'], [0, 5, 5])
+    np.testing.assert_allclose(df['realized_pnl'], [300, 50, 0])
+    np.testing.assert_allclose(df['unrealized_pnl'], [0, 100, 50])
+
+
+def test_sell_unknown_ticker_raises():
+    book = make_book('fifo')
+
+    with pytest.raises(ValueError):
+        book.sell('CCC', '2020-01-04', 1, 100)
+
+
+def test_oversell_raises_and_leaves_lots_unchanged():
+    book = make_book('fifo')
+
+    with pytest.raises(ValueError):
+        book.sell('AAA', '2020-01-04', 21, 140)
+    np.testing.assert_allclose(book['AAA'].lot_remaining, [10, 10])
+
+
+def test_invalid_cost_method_raises():
+    with pytest.raises(ValueError):
+        PositionBook('hifo')
+    with pytest.raises(ValueError):
+        Position('AAA', 'hifo')
+
+
+@pytest.mark.parametrize('cost_method', ['fifo', 'lifo', 'average'])
+def test_fractional_sale_closes_lots(cost_method):
+    position = Position('AAA', cost_method)
+    position.buy('2020-01-01', 0.1, 100)
+    position.buy('2020-01-02', 0.2, 100)
+
+    position.sell('2020-01-03', 0.3, 100)
+
+    assert list(position.lot_remaining) == [0, 0]
+    assert position.first_open == position.num_lots
+
+
+def test_first_open_advances_past_closed_lots():
+    position = Position('AAA', 'fifo')
+    for i in range(20):
+        position.buy('2020-01-01', 1, 100 + i)
+
+    position.sell('2020-01-02', 5.5, 130)
+
+    assert position.first_open == 5
+    assert position.get_qty() == pytest.approx(14.5)
+
+
+def test_get_qty_history():
+    position = Position('AAA')
+    position.buy('2020-01-01', 10, 100)
+    position.buy('2020-01-03', 10, 120)
+    position.sell('2020-01-03', 5, 130)
+    position.sell('2020-01-05', 15, 130)
+
+    dates = pd.Index(['2020-01-01', '2020-01-02', '2020-01-03', '2020-01-06'])
+
+    assert list(position.get_qty_history(dates)) == [10, 10, 15, 0]
+
+
+def test_sale_dated_before_lots_raises():
+    position = Position('AAA')
+    position.buy('2020-06-10', 10, 100)
+
+    with pytest.raises(ValueError):
+        position.sell('2020-06-01', 5, 100)
+    np.testing.assert_allclose(position.lot_remaining, [10])
+
+
+def test_sale_only_matches_lots_dated_on_or_before_it():
+    position = Position('AAA', 'lifo')
+    position.buy('2020-06-01', 10, 100)
+    position.buy('2020-06-10', 10, 120)
+
+    assert position.sell('2020-06-05', 5, 110) == pytest.approx(50)
+    np.testing.assert_allclose(position.lot_remaining, [5, 10])
+
+
+def test_backdated_buy_is_oldest_lot_under_fifo():
+    position = Position('AAA', 'fifo')
+    position.buy('2020-06-10', 10, 120)
+    position.buy('2020-06-01', 10, 100)
+
+    assert list(position.lot_dates) == ['2020-06-01', '2020-06-10']
+    assert position.sell('2020-06-15', 10, 130) == pytest.approx(300)
+    np.testing.assert_allclose(position.lot_remaining, [0, 10])
+
+
+def test_backdated_sale_that_leaves_later_quantity_negative_raises():
+    position = Position('AAA', 'lifo')
+    position.buy('2020-06-01', 10, 100)
+    position.buy('2020-06-08', 10, 120)
+    position.sell('2020-06-10', 15, 110)
+
+    with pytest.raises(ValueError):
+        position.sell('2020-06-05', 6, 110)
+    position.sell('2020-06-05', 5, 110)
+    assert list(position.get_qty_history(pd.Index(['2020-06-05', '2020-06-10']))) == [5, 0]